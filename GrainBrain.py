@@ -1,25 +1,18 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
 import os
 import io
+import pickle
 import time
+import threading
 import serial
 import serial.tools.list_ports
-from scipy.signal import find_peaks
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
 from datetime import datetime
-from scipy.stats import mode
-from serial_connection import SerialConnection
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Image
+from serial_connection import SerialConnection, ScaleReadError
 
-matplotlib.use('Agg')  # Use a non-interactive backend for Streamlit
+# matplotlib, reportlab, xlsxwriter and scipy are only needed in Step 4; they are imported
+# inside the functions that use them so Steps 1–3 never load them.
 
 
 # ✅ Persistent connection (cached across page reloads)
@@ -33,14 +26,19 @@ def init_serial_connection(port="COM4"):
         return None
 
 def close_serial_connection():
-    if "scale" in st.session_state and st.session_state.scale:
-        st.session_state.scale.close()
-        del st.session_state.scale
+    scale = st.session_state.pop("scale", None)
+    if scale:
+        # Release the COM port (and let the OS settle) off the UI thread
+        threading.Thread(target=lambda: (scale.close(), time.sleep(2)), daemon=True).start()
         st.cache_resource.clear()
-        time.sleep(2)  # Allow OS to release COM port
+
+# ✅ Port enumeration walks the OS device list; refresh it at most every 5 s
+@st.cache_data(ttl=5.0)
+def _list_ports():
+    return [p.device for p in serial.tools.list_ports.comports()]
 
 # Allow user to select COM port dynamically
-available_ports = [p.device for p in serial.tools.list_ports.comports()]
+available_ports = _list_ports()
 selected_port = st.selectbox("🔌 Select COM port:", available_ports, index=available_ports.index("COM4") if "COM4" in available_ports else 0)
 
 
@@ -48,27 +46,60 @@ selected_port = st.selectbox("🔌 Select COM port:", available_ports, index=ava
 if "scale" not in st.session_state or st.session_state.scale is None:
     st.session_state.scale = init_serial_connection(selected_port)
 
+# ✅ Read straight from the in-process serial connection
 def read_weight():
-    if st.session_state.scale:
-        return st.session_state.scale.read_weight()
-    else:
-        st.error("⚠️ Scale connection unavailable.")
-        return np.nan
+    scale = st.session_state.get("scale")
+    if not scale:
+        raise ScaleReadError("Scale connection is not available.")
+    return scale.read_weight()
+
+
+# ✅ Measure one sieve per submit (one form, one rerun per measurement)
+# `weights` is aligned with sieve_sizes (NaN = not measured); `indices` picks the rows to show
+def measure_sieves(form_key, weights, indices, describe):
+    pending = indices[np.isnan(weights[indices])]
+    target = pending[0] if pending.size else indices[0]
+    round_key = f"{form_key}_round"
+    rounds = st.session_state.setdefault(round_key, 0)
+
+    with st.form(form_key):
+        for idx in indices:
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.write(describe(idx))
+            with col2:
+                st.write("—" if np.isnan(weights[idx]) else f"✅ {weights[idx]} g")
 
-# ✅ Reliable weight reading function
-def read_weight():
-    if "scale" in st.session_state and st.session_state.scale:
-        raw_weight = st.session_state.scale.read_weight()
-        try:
-            return float(raw_weight)
-        except (ValueError, TypeError):
-            st.warning(f"⚠️ Received invalid data: {raw_weight}")
-            return np.nan
-    else:
-        st.error("⚠️ Scale connection is not available.")
-        return np.nan
+        if pending.size:
+            st.info(f"👉 Place sieve **{sieve_sizes[target]} μm** on the scale, then press Measure "
+                    "(to redo another sieve, pick it below first).")
+        else:
+            st.success("✅ All sieves measured. Pick a sieve below to re-measure or clear it.")
 
+        # A fresh key per submit, so every render starts on the sieve the prompt names
+        idx = st.selectbox(
+            "Sieve", indices, index=int(np.flatnonzero(indices == target)[0]),
+            format_func=lambda i: f"{sieve_sizes[i]} μm", key=f"{form_key}_target_{rounds}",
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            measure = st.form_submit_button("📏 Measure")
+        with col2:
+            clear = st.form_submit_button("🗑️ Clear")
+
+    if measure or clear:
+        st.session_state[round_key] = rounds + 1
 
+    if measure:
+        try:
+            weights[idx] = read_weight()
+        except ScaleReadError as e:
+            st.error(f"⚠️ Measurement failed for sieve {sieve_sizes[idx]} μm: {e}")
+            return
+        st.rerun()
+    if clear:
+        weights[idx] = np.nan
+        st.rerun()
 
 
 # ✅ Define Sieve Sizes
@@ -77,8 +108,156 @@ sieve_sizes = np.array([
     355, 300, 250, 180, 150, 125, 106, 90, 74, 63, 0
 ])
 
-# ✅ File for storing empty sieve weights
-empty_sieve_file = "empty_sieve_weights.csv"
+# ✅ File for storing empty sieve weights ({size: weight} pickle); older versions wrote a CSV
+empty_sieve_file = "empty_sieve_weights.pkl"
+legacy_empty_sieve_file = "empty_sieve_weights.csv"
+
+# ✅ Load the empty sieve file once per modification (mtime is part of the cache key)
+@st.cache_data
+def _load_empty(path, mtime):
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+    else:
+        df = pd.read_csv(path)
+        saved = dict(zip(df["Sieve Size (μm)"], df["Empty Weight (g)"]))
+    weights = np.full(sieve_sizes.size, np.nan)
+    sizes = np.fromiter(saved.keys(), dtype=int, count=len(saved))
+    values = np.fromiter(saved.values(), dtype=float, count=len(saved))
+    idx = np.minimum(np.searchsorted(-sieve_sizes, -sizes), sieve_sizes.size - 1)
+
+    # Only keep sizes that are real sieves; anything else would land in a neighbour's slot
+    known = sieve_sizes[idx] == sizes
+    if not known.all():
+        st.warning(f"⚠️ Ignoring unknown sieve sizes in {path}: {', '.join(map(str, sizes[~known]))} μm")
+    weights[idx[known]] = values[known]
+    return weights
+
+def _save_empty(path, weights):
+    measured = ~np.isnan(weights)
+    with open(path, "wb") as f:
+        pickle.dump(dict(zip(sieve_sizes[measured].tolist(), weights[measured].tolist())), f)
+
+def _empty_csv(weights):
+    measured = ~np.isnan(weights)
+    rows = (f"{size},{weight}\n" for size, weight in zip(sieve_sizes[measured], weights[measured]))
+    return ("Sieve Size (μm),Empty Weight (g)\n" + "".join(rows)).encode()
+
+# ✅ Render the results plot once per data set; returns (screen PNG, 300 DPI PNG for the PDF)
+@st.cache_data(max_entries=4)  # only the current results page is ever re-read
+def _build_plot(mid_sizes, percents, net_weights):
+    import matplotlib
+    matplotlib.use('Agg')  # Use a non-interactive backend for Streamlit
+    import matplotlib.pyplot as plt
+
+    mid_sizes = np.array(mid_sizes)
+    fig, ax1 = plt.subplots(figsize=(8, 5))
+    ax1.plot(mid_sizes, percents, marker='o', linestyle='-', color='blue', label="Cumulative % Passing")
+    ax1.set_xscale('log')
+    ax1.set_xlabel('Grain size (μm)')
+    ax1.set_ylabel('Cumulative % passing', color='blue')
+    ax1.grid(True, which='both', ls='--', lw=0.5)
+
+    ax2 = ax1.twinx()
+    ax2.bar(mid_sizes, net_weights, width=mid_sizes/3, alpha=0.5, color='gray', label="Net Weight")
+    ax2.set_ylabel('Net Weight (g)', color='gray')
+    ax2.invert_xaxis()
+    ax1.set_title('Grain-Size Distribution with Net Weight')
+
+    screen_buffer = io.BytesIO()
+    fig.savefig(screen_buffer, format="png", dpi=200, bbox_inches='tight')  # what st.pyplot rendered
+    print_buffer = io.BytesIO()
+    fig.savefig(print_buffer, format="png", dpi=300, bbox_inches='tight')
+    plt.close(fig)
+    return screen_buffer.getvalue(), print_buffer.getvalue()
+
+# ✅ Build the PDF report and return its bytes
+def generate_pdf_report(sample_id, mean_size, d10, d50, d90, modes, selected_sizes, mid_sizes_sorted, net_weights, print_png):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Image
+
+    pdf_buffer = io.BytesIO()
+
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
+    elements = []
+
+    # Title & Date Table
+    title = [["Auto Sieve Report", sample_id],
+            ["Date", datetime.now().strftime('%d/%m/%Y')]]
+    title_table = Table(title, colWidths=[3 * inch, 3 * inch])
+    title_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+    ]))
+    elements.extend([title_table, Spacer(1, 12)])
+
+    # Grain-Size Statistics Table (existing)
+    stats_data = [
+        ["Statistic", "Value (μm)"],
+        ["Mean size", f"{mean_size:.2f}"],
+        ["D10", f"{d10:.2f}"],
+        ["D50", f"{d50:.2f}"],
+        ["D90", f"{d90:.2f}"],
+        ["Mode 1", f"{modes[0]:.2f}" if not np.isnan(modes[0]) else "-"],
+        ["Mode 2", f"{modes[1]:.2f}" if not np.isnan(modes[1]) else "-"],
+        ["Mode 3", f"{modes[2]:.2f}" if not np.isnan(modes[2]) else "-"],
+    ]
+    stats_table = Table(stats_data, colWidths=[3 * inch, 3 * inch])
+    stats_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ]))
+    elements.extend([stats_table, Spacer(1, 12)])
+
+    # Raw Data Table (existing)
+    raw_data_table = [["Sieve Size (μm)", "Mid Sieve Size (μm)", "Net Weight (g)"]] + np.column_stack([
+        np.asarray(selected_sizes).astype(str),
+        np.char.mod('%.2f', mid_sizes_sorted),
+        np.char.mod('%.2f', net_weights),
+    ]).tolist()
+
+    raw_table = Table(raw_data_table, colWidths=[2 * inch, 2 * inch, 2 * inch])
+    raw_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ]))
+    elements.extend([raw_table, Spacer(1, 12)])
+
+    # ✅ Generate the matplotlib plot and insert into PDF
+    plot_buffer = io.BytesIO(print_png)
+
+    # Define plot size in PDF (width, height)
+    pdf_plot = Image(plot_buffer, 6 * inch, 4 * inch)
+    elements.append(pdf_plot)
+
+    # Generate PDF
+    doc.build(elements)
+
+    return pdf_buffer.getvalue()
+
+# ✅ Write the results tables straight to an in-memory .xlsx (no pandas Excel formatter)
+def build_excel(sheets):
+    import xlsxwriter
+
+    excel_buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(excel_buffer, {'in_memory': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    for sheet_name, df in sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, df.columns, header_format)
+        cells = df.astype(object).where(df.notna(), None)  # NaN -> blank cell, as pandas writes it
+        for r, row in enumerate(cells.itertuples(index=False), start=1):
+            worksheet.write_row(r, 0, row)
+    workbook.close()
+    return excel_buffer.getvalue()
 
 # ✅ Initialize Session State
 if "step" not in st.session_state:
@@ -87,10 +266,11 @@ if "sample_id" not in st.session_state:
     st.session_state["sample_id"] = ""
 if "selected_sizes" not in st.session_state:
     st.session_state["selected_sizes"] = []
+# Weights are stored as arrays aligned with sieve_sizes; NaN means "not measured yet"
 if "empty_weights" not in st.session_state:
-    st.session_state["empty_weights"] = {}
+    st.session_state["empty_weights"] = np.full(sieve_sizes.size, np.nan)
 if "sample_weights" not in st.session_state:
-    st.session_state["sample_weights"] = {}
+    st.session_state["sample_weights"] = np.full(sieve_sizes.size, np.nan)
 
 
 # ✅ Main UI Logic
@@ -106,14 +286,14 @@ def main():
         if sample_id:
             st.session_state["sample_id"] = sample_id
 
-        if os.path.exists(empty_sieve_file):
+        saved_file = next((f for f in (empty_sieve_file, legacy_empty_sieve_file) if os.path.exists(f)), None)
+        if saved_file:
             st.write("⚙️ **Existing empty sieve data found.** Choose an option:")
             if st.button("📂 Use Existing Data"):
-                existing_data = pd.read_csv(empty_sieve_file)
-                st.session_state["empty_weights"] = dict(zip(existing_data["Sieve Size (μm)"], existing_data["Empty Weight (g)"]))
+                st.session_state["empty_weights"] = _load_empty(saved_file, os.path.getmtime(saved_file))
                 st.success("✅ Using saved empty sieve weights.")
             if st.button("🔄 Recalibrate"):
-                st.session_state["empty_weights"] = {}
+                st.session_state["empty_weights"] = np.full(sieve_sizes.size, np.nan)
                 st.warning("⚠️ Proceeding to recalibrate empty sieve weights.")
 
         if st.button("Next →"):
@@ -130,32 +310,22 @@ def main():
         st.title("Auto Sieve - Step 2: Measure Empty Sieve Weights")
         st.write(f"Sample ID: **{st.session_state['sample_id']}**")
 
-        for size in sieve_sizes:
-            col1, col2 = st.columns([2, 1])
-            with col1:
-                st.write(f"Sieve {size} μm")
-            with col2:
-                weight = st.session_state["empty_weights"].get(size)
-                button_label = f"✅ {weight} g" if weight is not None else f"Measure {size} μm"
-
-                if st.button(button_label, key=f"empty_{size}"):
-                    weight = read_weight()
-                    if np.isnan(weight):
-                        st.error(f"⚠️ Measurement failed for sieve {size} μm.")
-                    else:
-                        st.session_state["empty_weights"][size] = weight
-                        st.success(f"✅ {size} μm: {weight} g")
-                        st.rerun()
+        empty_weights = st.session_state["empty_weights"]
+        measure_sieves(
+            "measure_empty",
+            empty_weights,
+            np.arange(sieve_sizes.size),
+            lambda idx: f"Sieve {sieve_sizes[idx]} μm",
+        )
+
+        if not np.isnan(empty_weights).all():
+            st.download_button("Export Empty Weights (CSV)", data=_empty_csv(empty_weights), file_name=legacy_empty_sieve_file, mime="text/csv")
 
         if st.button("Next →", key="next_step_2"):
-            if not st.session_state["empty_weights"]:
+            if np.isnan(empty_weights).all():
                 st.warning("⚠️ Please measure at least one sieve before proceeding.")
             else:
-                df_empty = pd.DataFrame({
-                    "Sieve Size (μm)": list(st.session_state["empty_weights"].keys()),
-                    "Empty Weight (g)": list(st.session_state["empty_weights"].values())
-                })
-                df_empty.to_csv(empty_sieve_file, index=False)
+                _save_empty(empty_sieve_file, empty_weights)
                 st.session_state["step"] = 3
                 st.rerun()
 
@@ -166,27 +336,17 @@ def main():
         st.title("Auto Sieve - Step 3: Measure Sieve+Sample Weights")
         st.write(f"Sample ID: **{st.session_state['sample_id']}**")
 
-        for size in st.session_state["empty_weights"]:
-            size_int = int(size)  # Ensure size is a standard Python int
-            col1, col2 = st.columns([2, 1])
-            with col1:
-                empty_weight = st.session_state['empty_weights'][size]
-                st.write(f"Sieve {size_int} μm (Empty: {empty_weight} g)")
-            with col2:
-                weight = st.session_state["sample_weights"].get(size_int)
-                button_label = f"✅ {weight} g" if weight is not None else f"Measure Sample {size_int} μm"
-
-                if st.button(button_label, key=f"sample_{size_int}"):
-                    weight = read_weight()
-                    if np.isnan(weight):
-                        st.error(f"❌ Measurement failed for sieve {size_int} μm.")
-                    else:
-                        st.session_state["sample_weights"][size_int] = weight
-                        st.success(f"✅ Measured: {weight} g")
-                        st.rerun()
+        empty_weights = st.session_state["empty_weights"]
+        measured = np.flatnonzero(~np.isnan(empty_weights))
+        measure_sieves(
+            "measure_sample",
+            st.session_state["sample_weights"],
+            measured,
+            lambda idx: f"Sieve {sieve_sizes[idx]} μm (Empty: {empty_weights[idx]} g)",
+        )
 
         if st.button("Next →", key="next_step_3"):
-            if len(st.session_state["sample_weights"]) < len(st.session_state["empty_weights"]):
+            if np.isnan(st.session_state["sample_weights"][measured]).any():
                 st.warning("⚠️ Please measure all sieve+sample weights before proceeding.")
             else:
                 st.session_state["step"] = 4
@@ -208,80 +368,55 @@ def main():
             st.error("⚠️ Missing data. Please restart the process.")
             st.stop()
 
-        # ✅ Convert NumPy int64 keys to Python int
-        selected_sizes = np.array(sorted([int(size) for size in st.session_state["empty_weights"].keys()]))
-        empty_weights = np.array([st.session_state["empty_weights"][size] for size in selected_sizes])
-        sample_weights = np.array([st.session_state["sample_weights"].get(size, np.nan) for size in selected_sizes])
+        # ✅ One table of the measured sieves (largest first); every derived column is computed on it
+        measured = ~np.isnan(st.session_state["empty_weights"])
+        df = pd.DataFrame({
+            "size": sieve_sizes[measured],
+            "empty": st.session_state["empty_weights"][measured],
+            "sample": st.session_state["sample_weights"][measured],
+        })
+        assert np.all(np.diff(df["size"]) < 0)  # sieve_sizes is strictly descending, so no re-sort is needed
 
         # ✅ Check for missing sample weights
-        if np.all(np.isnan(sample_weights)):
+        if df["sample"].isna().all():
             st.warning("⚠️ No valid sample weights recorded. Please return to Step 3 and measure sieve+sample weights.")
             if st.button("← Back to Step 3"):
                 st.session_state["step"] = 3
                 st.rerun()
             st.stop()
 
-        # ✅ Calculate net sample weights
-        net_weights = sample_weights - empty_weights
-
-        # ✅ Check if any valid sample weights exist
-        if np.isnan(net_weights).all():
-            st.error("⚠️ No valid sample weights recorded. Please return to Step 3 and measure sieve+sample weights.")
-            if st.button("← Back to Step 3"):
-                st.session_state["step"] = 3
-                st.rerun()
-            st.stop()
-
-        # ✅ Sort sieve sizes in ascending order
-        sorted_indices = np.argsort(selected_sizes)
-        sorted_sizes = selected_sizes[sorted_indices]
-        sorted_net_weights = net_weights[sorted_indices]
-
-        # ✅ Calculate Mid Sieve Sizes Correctly
-        mid_sizes_sorted = []
-        for i, size in enumerate(sorted_sizes):
-            if i < len(sorted_sizes) - 1:
-                mid = (size + sorted_sizes[i + 1]) / 2
-            else:  # Largest sieve
-                mid = size + 0.5 * size
-            mid_sizes_sorted.append(mid)
-
-        # ✅ Restore the original order of mid sieve sizes to match selected_sizes
-        mid_sizes_sorted = [mid_sizes_sorted[np.where(sorted_sizes == s)[0][0]] for s in selected_sizes]
+        # ✅ Net sample weights and mid sieve sizes (halfway to the next larger sieve; 1.5× for the largest)
+        df["net"] = df["sample"] - df["empty"]
+        df["mid"] = ((df["size"] + df["size"].shift(1)) / 2).fillna(df["size"] * 1.5)
 
         # ✅ Handle special case where all weights are zero
-        if sorted_net_weights.sum() == 0:
+        total = df["net"].sum()
+        if total == 0:
             mean_size, d10, d50, d90 = np.nan, np.nan, np.nan, np.nan
-            percents = np.zeros(len(mid_sizes_sorted))
+            df["passing"] = 0.0
             st.warning("⚠️ No valid sample mass detected. Statistics will be empty.")
         else:
-            # ✅ Compute cumulative % passing
-            cumulative = np.cumsum(sorted_net_weights[::-1])[::-1]
-            percents1 =  (cumulative / cumulative[0] * 100)
-            percents = 100- (cumulative / cumulative[0] * 100)
+            # ✅ Compute cumulative % retained (coarse to fine) and % passing
+            df["retained"] = df["net"].cumsum() / total * 100
+            df["passing"] = 100 - df["retained"]
 
-            # ✅ Compute grain-size statistics
-            mean_size = np.average(mid_sizes_sorted, weights=sorted_net_weights)
-            d90 = np.interp(10, percents1[::-1], mid_sizes_sorted[::-1])
-            d50 = np.interp(50, percents1[::-1], mid_sizes_sorted[::-1])
-            d10 = np.interp(90, percents1[::-1], mid_sizes_sorted[::-1])
+            # ✅ Compute grain-size statistics (% retained is already increasing, as np.interp needs)
+            mean_size = np.average(df["mid"], weights=df["net"])
+            d90, d50, d10 = np.interp([10, 50, 90], df["retained"], df["mid"])
 
-       # ✅ Calculate Modes (up to 3 prominent peaks) properly using histogram peaks
-
-            mid_sizes_sorted_array = np.array(mid_sizes_sorted)  # Convert to NumPy array first!
+        # ✅ Calculate Modes (up to 3 prominent peaks) properly using histogram peaks
+        mids = df["mid"].to_numpy()[::-1]  # histogram bins must be increasing
 
         # Create a weighted histogram to find prominent modes
-        bins = np.concatenate((mid_sizes_sorted_array, [mid_sizes_sorted_array[-1] + 1]))
-        hist, bin_edges = np.histogram(
-            np.repeat(mid_sizes_sorted_array, np.round(sorted_net_weights * 100).astype(int)),
-            bins=bins
-        )
+        bins = np.append(mids, mids[-1] + 1)
+        hist, bin_edges = np.histogram(mids, bins=bins, weights=df["net"].to_numpy()[::-1])
 
         # Find peaks in the histogram (prominent modes)
+        from scipy.signal import find_peaks
         peaks, _ = find_peaks(hist)
 
         # Get peak mid-size values and their counts
-        peak_sizes = mid_sizes_sorted_array[peaks]  # Now indexing works
+        peak_sizes = mids[peaks]
         peak_counts = hist[peaks]
 
         # Sort peaks by their prominence (highest counts first)
@@ -303,34 +438,19 @@ def main():
             # ✅ Display Full Raw Data Table
         st.subheader("Raw Data")
         raw_data = pd.DataFrame({
-                "Sieve Size (μm)": selected_sizes,
-                "Mid Sieve Size (μm)": mid_sizes_sorted,
-                "Net Weight (g)": net_weights
+                "Sieve Size (μm)": df["size"],
+                "Mid Sieve Size (μm)": df["mid"],
+                "Net Weight (g)": df["net"]
             })
         st.table(raw_data)
 
             # ✅ Generate and Show the Plot
-        fig, ax1 = plt.subplots(figsize=(8, 5))
-        ax1.plot(mid_sizes_sorted, percents, marker='o', linestyle='-', color='blue', label="Cumulative % Passing")
-        ax1.set_xscale('log')
-        ax1.set_xlabel('Grain size (μm)')
-        ax1.set_ylabel('Cumulative % passing', color='blue')
-        ax1.grid(True, which='both', ls='--', lw=0.5)
-
-        ax2 = ax1.twinx()
-        ax2.bar(mid_sizes_sorted, sorted_net_weights, width=np.array(mid_sizes_sorted)/3, alpha=0.5, color='gray', label="Net Weight")
-        ax2.set_ylabel('Net Weight (g)', color='gray')
-        ax2.invert_xaxis()
-        plt.title('Grain-Size Distribution with Net Weight')
-        st.pyplot(fig)
+        screen_png, print_png = _build_plot(tuple(df["mid"]), tuple(df["passing"]), tuple(df["net"]))
+        st.image(screen_png, width="stretch")
 
             # ✅ Export to Excel
         excel_filename = f"{sample_id}_sieve_results.xlsx"
-        excel_buffer = io.BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                raw_data.to_excel(writer, sheet_name='Raw Data', index=False)
-                stats_data.to_excel(writer, sheet_name='Statistics', index=False)
-        excel_bytes = excel_buffer.getvalue()
+        excel_bytes = build_excel({'Raw Data': raw_data, 'Statistics': stats_data})
         st.download_button("Download Results (Excel)", data=excel_bytes, file_name=excel_filename, mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
             # ✅ Export Raw Data to CSV
@@ -341,81 +461,12 @@ def main():
          
             # ✅ Export pdf report
 
-        def generate_pdf_report():
-            sample_id = st.session_state.get('sample_id', 'No Sample ID')
-            pdf_filename = f"{sample_id}_report.pdf"
-            pdf_buffer = io.BytesIO()
-
-            doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
-            elements = []
-
-            # Title & Date Table
-            title = [["Auto Sieve Report", sample_id],
-                    ["Date", datetime.now().strftime('%d/%m/%Y')]]
-            title_table = Table(title, colWidths=[3 * inch, 3 * inch])
-            title_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-            ]))
-            elements.extend([title_table, Spacer(1, 12)])
-
-            # Grain-Size Statistics Table (existing)
-            stats_data = [
-                ["Statistic", "Value (μm)"],
-                ["Mean size", f"{mean_size:.2f}"],
-                ["D10", f"{d10:.2f}"],
-                ["D50", f"{d50:.2f}"],
-                ["D90", f"{d90:.2f}"],
-                ["Mode 1", f"{modes[0]:.2f}" if not np.isnan(modes[0]) else "-"],
-                ["Mode 2", f"{modes[1]:.2f}" if not np.isnan(modes[1]) else "-"],
-                ["Mode 3", f"{modes[2]:.2f}" if not np.isnan(modes[2]) else "-"],
-            ]
-            stats_table = Table(stats_data, colWidths=[3 * inch, 3 * inch])
-            stats_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-            ]))
-            elements.extend([stats_table, Spacer(1, 12)])
-
-            # Raw Data Table (existing)
-            raw_data_table = [["Sieve Size (μm)", "Mid Sieve Size (μm)", "Net Weight (g)"]]
-            for i in range(len(selected_sizes)):
-                raw_data_table.append([
-                    selected_sizes[i],
-                    f"{mid_sizes_sorted[i]:.2f}",
-                    f"{net_weights[i]:.2f}"
-                ])
-
-            raw_table = Table(raw_data_table, colWidths=[2 * inch, 2 * inch, 2 * inch])
-            raw_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-            ]))
-            elements.extend([raw_table, Spacer(1, 12)])
-
-            # ✅ Generate the matplotlib plot and insert into PDF
-            plot_buffer = io.BytesIO()
-            fig.savefig(plot_buffer, format="png", dpi=300, bbox_inches='tight')
-            plot_buffer.seek(0)
-            
-            # Define plot size in PDF (width, height)
-            pdf_plot = Image(plot_buffer, 6 * inch, 4 * inch)
-            elements.append(pdf_plot)
-
-            # Generate PDF
-            doc.build(elements)
-
-            pdf_bytes = pdf_buffer.getvalue()
-            st.download_button("Download Report (PDF)", data=pdf_bytes, file_name=pdf_filename, mime="application/pdf")
-
-        # Call this after the existing plot is generated by matplotlib
-        generate_pdf_report()
+        if st.button("📄 Prepare PDF"):
+            pdf_bytes = generate_pdf_report(
+                sample_id, mean_size, d10, d50, d90, modes,
+                df["size"], df["mid"], df["net"], print_png,
+            )
+            st.download_button("Download Report (PDF)", data=pdf_bytes, file_name=f"{sample_id}_report.pdf", mime="application/pdf")
 
 
             # Navigation button
@@ -1,6 +1,45 @@
+import math
 import serial
 import time
-import numpy as np
+
+
+class ScaleReadError(Exception):
+    """Raised when no valid weight could be read from the scale."""
+
+
+class ReadBufferingStream:
+    """Chunked read buffer over a serial port, so a line costs one read per chunk instead of per byte."""
+
+    def __init__(self, ser, buffer_size=64):
+        self.ser = ser
+        self.buffer_size = buffer_size
+        self._buf = bytearray()
+
+    def reset_input_buffer(self):
+        """Drop both the OS input buffer and any bytes already pulled into this buffer."""
+        self.ser.reset_input_buffer()
+        self._buf.clear()
+
+    def read_until(self, expected=b'\n', size=None):
+        """Return bytes up to and including `expected` (at most `size`), or whatever arrived before the port timed out."""
+        while True:
+            end = self._buf.find(expected)
+            end = end + len(expected) if end >= 0 else None
+            if size is not None and len(self._buf) >= size:
+                end = min(end or size, size)
+            if end is not None:
+                line = bytes(self._buf[:end])
+                del self._buf[:end]
+                return line
+
+            # Take everything already waiting (up to one chunk); block for at least one byte
+            chunk = self.ser.read(min(self.buffer_size, max(1, self.ser.in_waiting)))
+            if not chunk:  # timed out
+                line = bytes(self._buf)
+                self._buf.clear()
+                return line
+            self._buf += chunk
+
 
 class SerialConnection:
     """Robust Serial Connection Handler for Scale."""
@@ -10,6 +49,7 @@ class SerialConnection:
         self.baudrate = baudrate
         self.timeout = timeout
         self.ser = None
+        self.reader = None
         self.connect()
 
     def connect(self):
@@ -29,37 +69,35 @@ class SerialConnection:
             print(f"❌ Permission error: {e}")
             self.ser = None
 
+        # Buffer reads in 64-byte chunks instead of pyserial's byte-at-a-time readline
+        self.reader = ReadBufferingStream(self.ser, buffer_size=64) if self.ser else None
+
     def read_weight(self):
         """Read weight from the scale via serial."""
         if self.ser is None:
             print("⚠️ No connection to scale. Cannot read weight.")
-            return np.nan
+            raise ScaleReadError("No connection to scale.")
 
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                self.ser.reset_input_buffer()  # Clear the input buffer first
+                self.reader.reset_input_buffer()  # Clear the input buffer first
                 self.ser.write(b'SI\r\n')      # Request new weight measurement
-                time.sleep(1.5)                # Wait longer (1.5s) to ensure new data is ready
 
-                # Read until we get a non-empty line or timeout
-                start_time = time.time()
-                line = ""
-                while (time.time() - start_time) < self.timeout:
-                    if self.ser.in_waiting > 0:
-                        line = self.ser.readline().decode('ascii').strip()
-                        if line:
-                            break
+                # One framed read: block (bounded by the port timeout) until the CRLF terminator
+                line = self.reader.read_until(b'\r\n', size=64).decode('ascii', errors='replace').strip()
 
                 if not line:
                     raise ValueError("Empty response from scale.")
 
-                # Check if the line format is correct ('SI x.xx g')
+                # Check if the line format is correct ('SI x.xx g'); float() rejects a malformed number
                 parts = line.split()
-                if len(parts) < 3 or not parts[1].replace('.', '', 1).isdigit():
+                if len(parts) < 3:
                     raise ValueError(f"Unexpected response format: '{line}'")
 
                 weight = float(parts[1])
+                if not math.isfinite(weight):  # float() also accepts 'nan' / 'inf'
+                    raise ValueError(f"Non-finite weight in response: '{line}'")
                 print(f"✅ Weight read: {weight} g")
                 return weight
 
@@ -69,13 +107,13 @@ class SerialConnection:
 
         # All retries failed
         print("❌ Failed to read valid weight after multiple attempts.")
-        return np.nan
+        raise ScaleReadError(f"No valid weight after {max_retries} attempts.")
 
-
-def close(self):
-    """Close the serial connection explicitly."""
-    if self.ser and self.ser.is_open:
-        self.ser.close()
-        self.ser = None
-        print(f"🔌 Connection to {self.port} closed.")
+    def close(self):
+        """Close the serial connection explicitly."""
+        if self.ser and self.ser.is_open:
+            self.ser.close()
+            self.ser = None
+            self.reader = None
+            print(f"🔌 Connection to {self.port} closed.")
 